@@ -1,10 +1,10 @@
 import pandas as pd
 
-from .ask import ask, update
+from .ask import aask, ask, aupdate, update
 from .indexer import ReportIndexer
 from .vectorstores import VectorStore
 
-__all__ = ['ReportIndexer', 'VectorStore', 'ask', 'update']
+__all__ = ['ReportIndexer', 'VectorStore', 'aask', 'ask', 'aupdate', 'update']
 
 # Adjust some dependency settings
 pd.set_option('display.max_columns', None)  # Show all columns when printing
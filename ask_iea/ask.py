@@ -1,7 +1,19 @@
 """Manages the full pipeline of ask-iea.
 """
+import asyncio
+import logging
+import re
+from functools import lru_cache
 from pathlib import Path
 
+import faiss
+import numpy as np
+import pandas as pd
+from langchain.cache import SQLiteCache
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.globals import get_llm_cache, set_llm_cache
+from langchain.storage import LocalFileStore
+
 from .chains import (
     chain_check_for_scope,
     chain_get_reports_from_question,
@@ -10,46 +22,111 @@ from .chains import (
     chain_retrieve_keywords,
     chain_summarize,
 )
-from .constants import ASK_IEA_DIR, PATH_FAISS_STORE, PATH_REPORTS_INDEX
+from .constants import ASK_IEA_DIR, PATH_EMBEDDINGS_CACHE, PATH_FAISS_STORE, PATH_LLM_CACHE, PATH_REPORTS_INDEX
 from .indexer import ReportIndexer
 from .utils.logger import Logger
+from .utils.utils import batch, run_sync
 from .vectorstores import VectorStore
 
 # Define a logger
 log = Logger(__name__)
 
-if PATH_REPORTS_INDEX.exists():
-    indexer = ReportIndexer(PATH_REPORTS_INDEX)
-else:
+# Maximum number of concurrent requests to the OpenAI API
+MAX_CONCURRENCY = 8
+# Number of reports to retrieve keywords for, before the results are logged
+KEYWORDS_BATCH_SIZE = 50
+# Number of reports which are preselected by their similarity to the question
+NUM_SIMILAR_REPORTS = 10
+# Minimum cosine similarity of the best matching report, to skip the report selection by the LLM for questions
+# without scope. Disabled by default (None), since the LLM selection also prefers timely reports and the WEO. To opt
+# in, set a value above the best similarities of ordinary questions, which are logged on debug level. Similarities of
+# OpenAI embeddings mostly lie in a narrow band of about 0.7 to 0.9
+REPORT_SIMILARITY_THRESHOLD = None
+# Summaries which match this pattern are not relevant for the question
+IRRELEVANT_SUMMARY_PATTERN = re.compile(r'not applicable|not relevant|does not provide', re.IGNORECASE)
+
+
+@lru_cache
+def _set_up_llm_cache() -> None:
+    # Cache LLM responses on disk. This is done on first use instead of on import, and a cache which is already set
+    # by the application is kept
+    if get_llm_cache() is None:
+        Path(ASK_IEA_DIR).mkdir(parents=True, exist_ok=True)
+        set_llm_cache(SQLiteCache(database_path=str(PATH_LLM_CACHE)))
+
+
+@lru_cache
+def _get_indexer() -> ReportIndexer:
+    if PATH_REPORTS_INDEX.exists():
+        return ReportIndexer(PATH_REPORTS_INDEX)
+    if PATH_REPORTS_INDEX.with_suffix('.csv').exists():
+        return ReportIndexer(PATH_REPORTS_INDEX.with_suffix('.csv'))
     indexer = ReportIndexer()
     indexer.add_new_reports(10)
-if PATH_FAISS_STORE.exists():
-    db = VectorStore(db_path=PATH_FAISS_STORE)
-else:
-    db = VectorStore(index_df=indexer.df)
+    return indexer
+
+
+@lru_cache
+def _get_db() -> VectorStore:
+    if PATH_FAISS_STORE.exists():
+        return VectorStore(db_path=PATH_FAISS_STORE)
+    return VectorStore(index_df=_get_indexer().df)
+
+
+@lru_cache
+def _get_df_index() -> pd.DataFrame:
+    indexer = _get_indexer()
+    df_index = indexer.df[indexer.df['url_pdf'].notna() & indexer.df['_keywords'].notna()]
+    df_index = df_index.reset_index()
+
+    # Precompute the report lines which are listed in the report selection prompts
+    prompt_keys = df_index.index.to_series().astype(str)
+    df_index['_prompt_row_scope'] = prompt_keys + ': ' + df_index['title'] + ')'
+    df_index['_prompt_row_full'] = prompt_keys + ':' + df_index['_year'].astype(str) + ':' + df_index['title']
 
-df_index = indexer.df[indexer.df['url_pdf'].notna() & indexer.df['_keywords'].notna()]
-df_index = df_index.reset_index()
+    return df_index
+
+
+@lru_cache
+def _get_report_titles() -> dict:
+    df_index = _get_df_index()
+    return dict(zip(df_index['report_id'], df_index['title']))
 
 
 def _add_keywords_to_index(first_n: int = None) -> None:
-    global indexer
+    _set_up_llm_cache()
+    indexer = _get_indexer()
 
     if '_keywords' not in indexer.df.columns:
-        indexer.df['_keywords'] = None
-        indexer.df['_year'] = None
+        indexer.df['_keywords'] = pd.Series(pd.NA, index=indexer.df.index, dtype='string')
+        indexer.df['_year'] = pd.Series(pd.NA, index=indexer.df.index, dtype='Int16')
 
     relevant_rows = indexer.df[indexer.df['url_pdf'].notna()][0:first_n]
-    for index, row in relevant_rows[relevant_rows['_keywords'].isna()].iterrows():
-        results = chain_retrieve_keywords.invoke(
-            {'title': row['title'], 'date_published': row['date_published'], 'abstract': row['abstract']}
+    missing_ids = relevant_rows.index[relevant_rows['_keywords'].isna()].tolist()
+
+    # Log the results after each batch to keep the progress if the process is interrupted
+    for batch_ids in batch(missing_ids, KEYWORDS_BATCH_SIZE):
+        inputs = (
+            indexer.df.loc[batch_ids, ['title', 'date_published', 'abstract']]
+            .astype({'date_published': 'string'})
+            .to_dict('records')
+        )
+        outputs = chain_retrieve_keywords.batch(
+            inputs, config={'max_concurrency': MAX_CONCURRENCY}, return_exceptions=True
         )
-        if not results:
-            results = {'keywords': [], 'year': None}
-        indexer.df.loc[index, '_keywords'] = ','.join([keyword.lower() for keyword in results['keywords']])
-        indexer.df.loc[index, '_year'] = results['year']
 
-        indexer.save_to_file(PATH_REPORTS_INDEX)
+        index_out, keywords_out, years_out = [], [], []
+        for index, results in zip(batch_ids, outputs):
+            if isinstance(results, Exception):
+                log.warning('Failed to retrieve keywords for "%s": %s', index, results)
+                continue
+            index_out.append(index)
+            keywords_out.append(','.join([keyword.lower() for keyword in results.keywords]))
+            years_out.append(results.year)
+
+        indexer.df.loc[index_out, '_keywords'] = keywords_out
+        indexer.df.loc[index_out, '_year'] = years_out
+        indexer.save_to_log(PATH_REPORTS_INDEX, index_out, ['_keywords', '_year'])
 
 
 def update_index(n_newest: int = 150) -> None:
@@ -60,15 +137,26 @@ def update_index(n_newest: int = 150) -> None:
         n_newest (int, optional): Number of newest reports to add. Defaults to 150.
 
     """
-    global indexer
+    indexer = _get_indexer()
 
-    # Update the index with new reports
+    # Update the index with new reports. If the index file exists, they are only appended to its log, which is
+    # compacted into the index file once at the end
     Path(ASK_IEA_DIR).mkdir(parents=True, exist_ok=True)
-    indexer.add_new_reports(n_newest=n_newest)
-    indexer.save_to_file(PATH_REPORTS_INDEX)
+    new_report_ids = indexer.add_new_reports(n_newest=n_newest)
+    if PATH_REPORTS_INDEX.exists():
+        indexer.save_to_log(PATH_REPORTS_INDEX, new_report_ids, indexer.df.columns.tolist())
+    else:
+        indexer.save_to_file(PATH_REPORTS_INDEX)
 
     # Add keywords to the index (using LangChain)
     _add_keywords_to_index(first_n=n_newest)
+    indexer.save_to_file(PATH_REPORTS_INDEX)
+
+    # Reset everything which is derived from the index
+    _get_df_index.cache_clear()
+    _get_report_titles.cache_clear()
+    _get_reports_prompt.cache_clear()
+    _get_reports_faiss_index.cache_clear()
 
 
 def update_db(first_n: int = 150) -> None:
@@ -79,9 +167,9 @@ def update_db(first_n: int = 150) -> None:
         first_n: Number of newest reports to add. Defaults to 150.
 
     """
-    global db
+    db = _get_db()
 
-    db.add_new_reports(indexer.df[:first_n])
+    db.add_new_reports(_get_indexer().df[:first_n])
     db.save_local(PATH_FAISS_STORE)
 
 
@@ -97,7 +185,72 @@ def update(first_n: int = 50) -> None:
     update_db(first_n=first_n)
 
 
-def get_relevant_reports(question: str, num_reports: int) -> list:
+async def aupdate(first_n: int = 50) -> None:
+    """Update both the index and the database with new reports, without blocking the event loop. See `update`.
+
+    Args:
+    ----
+        first_n: Number of newest reports to add. Defaults to 50.
+
+    """
+    await asyncio.to_thread(update, first_n=first_n)
+
+
+@lru_cache
+def _get_reports_prompt(column: str, num_reports: int) -> str:
+    return '\n - '.join(_get_df_index()[column].iloc[:num_reports])
+
+
+@lru_cache
+def _get_reports_faiss_index(num_reports: int) -> faiss.IndexFlatIP:
+    # Embed title and abstract of each report. Embeddings are cached on disk, so each report is only embedded once
+    embeddings = CacheBackedEmbeddings.from_bytes_store(
+        _get_db().embeddings, LocalFileStore(PATH_EMBEDDINGS_CACHE), namespace='reports'
+    )
+    reports = _get_df_index().iloc[:num_reports]
+    texts = (reports['title'] + '\n' + reports['abstract'].fillna('')).tolist()
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+    # Inner product of normalized vectors equals the cosine similarity
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+
+    return index
+
+
+def get_similar_reports(question: str, num_reports: int) -> list:
+    """Get the reports which are most similar to a question, based on the embeddings of their title and abstract.
+
+    Args:
+    ----
+        question: Question to ask.
+        num_reports: Number of reports which are taken into account.
+
+    Returns:
+    -------
+        list: List of report indices. Empty, if no report is similar enough to the question or the preselection is
+            disabled (see `REPORT_SIMILARITY_THRESHOLD`).
+
+    """
+    if REPORT_SIMILARITY_THRESHOLD is None:
+        return []
+
+    question_vector = np.asarray([_get_db().embed_query(question)], dtype=np.float32)
+    faiss.normalize_L2(question_vector)
+    similarities, indices = _get_reports_faiss_index(num_reports).search(question_vector, NUM_SIMILAR_REPORTS)
+
+    # Log the best similarity, to allow calibrating the threshold against real questions
+    if similarities[0, 0] < REPORT_SIMILARITY_THRESHOLD:
+        log.debug('Best report similarity %.3f is below threshold.', similarities[0, 0])
+        return []
+    log.debug('Best report similarity %.3f is above threshold.', similarities[0, 0])
+
+    # FAISS pads the results with -1, if less reports are available
+    return [int(i) for i in indices[0] if i >= 0]
+
+
+async def aget_relevant_reports(question: str, num_reports: int) -> list:
     """Get the most relevant reports for a question.
 
     Args:
@@ -110,33 +263,71 @@ def get_relevant_reports(question: str, num_reports: int) -> list:
         list: List of report indices.
 
     """
-    scope = chain_check_for_scope.invoke({'question': question})
-
-    if scope.lower() not in ['none']:
-        log.debug(f'Scope found: "{scope}"')
-        report_indices = chain_get_reports_from_scope.invoke(
+    _set_up_llm_cache()
+    # Loading the index can scrape and embed reports, so it is run in a thread to not block the event loop
+    df_index = await asyncio.to_thread(_get_df_index)
+
+    # Most questions have no scope, so the reports for the question are selected while the scope is checked and the
+    # reports are preselected by similarity
+    scope_task = asyncio.create_task(chain_check_for_scope.ainvoke({'question': question}))
+    no_scope_task = asyncio.create_task(
+        chain_get_reports_from_question.ainvoke(
             {
-                'scope': scope,
-                'reports': '\n - '.join(df_index[:num_reports].apply(lambda x: f"{x.name}: {x['title']})", axis=1)),
+                'question': question,
+                'reports': _get_reports_prompt('_prompt_row_full', num_reports),
             }
         )
+    )
+    try:
+        # The question is embedded in a thread, so that the event loop is not blocked
+        report_indices = await asyncio.to_thread(get_similar_reports, question, num_reports=num_reports)
+        if report_indices:
+            no_scope_task.cancel()
+        scope = await scope_task
+    except Exception:
+        scope_task.cancel()
+        no_scope_task.cancel()
+        raise
+
+    if scope.lower() not in ['none']:
+        log.debug('Scope found: "%s"', scope)
+        no_scope_task.cancel()
+        report_indices = (
+            await chain_get_reports_from_scope.ainvoke(
+                {
+                    'scope': scope,
+                    'reports': _get_reports_prompt('_prompt_row_scope', num_reports),
+                }
+            )
+        ).keys
+    elif report_indices:
+        log.debug('No scope in question found. Using reports preselected by similarity.')
     else:
         log.debug('No scope in question found. Using all reports.')
-        report_indices = chain_get_reports_from_question.invoke(
-            {
-                'question': question,
-                'reports': '\n - '.join(
-                    df_index[:num_reports].apply(lambda x: f"{x.name}:{int(x['_year'])}:{x['title']}", axis=1)
-                ),
-            }
-        )
+        report_indices = (await no_scope_task).keys
 
-    report_indices = [int(i) for i in report_indices]
-    log.debug('Using reports: ' + ', '.join(df_index.loc[report_indices].title))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug('Using reports: %s', ', '.join(df_index.loc[report_indices].title))
 
     return report_indices
 
 
+def get_relevant_reports(question: str, num_reports: int) -> list:
+    """Get the most relevant reports for a question. Synchronous wrapper around `aget_relevant_reports`.
+
+    Args:
+    ----
+        question: Question to ask.
+        num_reports:  Number of reports to return.
+
+    Returns:
+    -------
+        list: List of report indices.
+
+    """
+    return run_sync(aget_relevant_reports(question, num_reports=num_reports))
+
+
 def retrieve_docs(question: str, filter_dict: dict, n_docs: int = 5) -> list:
     """Retrieve documents from the database.
 
@@ -151,18 +342,27 @@ def retrieve_docs(question: str, filter_dict: dict, n_docs: int = 5) -> list:
         list: List of documents.
 
     """
-    global db
-
-    retriever = db.as_retriever(search_kwargs={'k': n_docs, 'filter': filter_dict})
-    docs = retriever.invoke(question)
-    log.debug(f'Retrieved {len(docs)} documents from DB.')
+    db = _get_db()
+    docs = db.similarity_search_by_vector(db.embed_query(question), k=n_docs, filter=filter_dict)
+    log.debug('Retrieved %d documents from DB.', len(docs))
+
+    # Keep only the best matching document per page, since each document is summarized separately
+    seen_pages = set()
+    docs = [
+        doc
+        for doc in docs
+        if (doc.metadata['source'], doc.metadata['page']) not in seen_pages
+        and (seen_pages.add((doc.metadata['source'], doc.metadata['page'])) or True)
+    ]
 
     return docs
 
 
-def ask(question: str, num_reports: int = 100) -> str:
+async def aask(question: str, num_reports: int = 100) -> str:
     """Ask a question and return the answer. Runs the full pipeline.
 
+    The retrieved documents are summarized concurrently.
+
     Args:
     ----
         question: Question to ask.
@@ -173,26 +373,36 @@ def ask(question: str, num_reports: int = 100) -> str:
         str: Answer to the question.
 
     """
-    global db
+    # Loading the index can scrape and embed reports, so it is run in a thread to not block the event loop
+    df_index = await asyncio.to_thread(_get_df_index)
 
-    log.debug(f'question: "{question}", num_reports: "{num_reports}"')
-    report_indices = get_relevant_reports(question, num_reports=num_reports)
+    log.debug('question: "%s", num_reports: "%d"', question, num_reports)
+    report_indices = await aget_relevant_reports(question, num_reports=num_reports)
     report_ids = df_index.loc[report_indices, 'report_id'].tolist()
 
     filter_dict = {'report_id': report_ids}
-    docs = retrieve_docs(question, filter_dict)
+    docs = await asyncio.to_thread(retrieve_docs, question, filter_dict)
 
-    relevant_docs = []
-    for doc in docs:
-        summary = chain_summarize.invoke(
+    summaries = await chain_summarize.abatch(
+        [
             {
                 'text': doc.page_content,
                 'report': doc.metadata['title'],
                 'question': question,
                 'summary_length': 'around 60 words',
             }
-        )
-        if any(item in summary.lower() for item in ['not applicable', 'not relevant', 'does not provide']):
+            for doc in docs
+        ],
+        config={'max_concurrency': MAX_CONCURRENCY},
+        return_exceptions=True,
+    )
+
+    relevant_docs = []
+    for doc, summary in zip(docs, summaries):
+        if isinstance(summary, Exception):
+            log.warning('Failed to summarize doc from "%s": %s', doc.metadata['title'], summary)
+            continue
+        if IRRELEVANT_SUMMARY_PATTERN.search(summary):
             continue
         relevant_docs.append(
             {
@@ -213,33 +423,50 @@ def ask(question: str, num_reports: int = 100) -> str:
             str: Formatted string.
 
         """
-        total_string = 'Sources:\n\n'
-        for doc_ in relevant_docs_:
-            string = (
+        return 'Sources:\n\n' + ''.join(
+            [
                 f"{doc_['summary']}\n"
                 f"Page {doc_['doc'].metadata['page']} | {doc_['doc'].metadata['title']}\n"
                 f"Link: {doc_['doc'].metadata['source']}#page={doc_['doc'].metadata['page']}\n\n"
-            )
-            total_string += string
-        return total_string
+                for doc_ in relevant_docs_
+            ]
+        )
 
     if relevant_docs:
-        total_sum_out = chain_qa.invoke(
+        sources = format_for_print(relevant_docs)
+        total_sum_out = await chain_qa.ainvoke(
             {
-                'context': format_for_print(relevant_docs),
+                'context': sources,
                 'answer_length': 'around 100 words',
                 'question': question,
             }
         )
 
-        final_answer = f'Answer:\n{total_sum_out}\n\n\n{format_for_print(relevant_docs)}'
+        final_answer = f'Answer:\n{total_sum_out}\n\n\n{sources}'
 
     else:
         final_answer = 'Could not find any relevant references.'
 
-    final_answer += '\n\nChecked the following reports:\n'
-    for report_id in report_ids:
-        report_name = df_index[df_index.report_id == report_id].title.values[0]
-        final_answer += f'\t- {report_name}\n'
+    report_titles = _get_report_titles()
+    checked_reports = ''.join([f'\t- {report_titles[report_id]}\n' for report_id in report_ids])
+    final_answer += f'\n\nChecked the following reports:\n{checked_reports}'
 
     return final_answer
+
+
+def ask(question: str, num_reports: int = 100) -> str:
+    """Ask a question and return the answer. Synchronous wrapper around `aask`.
+
+    If an event loop is already running (e.g. in a Jupyter notebook), prefer `aask`, since this call blocks the loop.
+
+    Args:
+    ----
+        question: Question to ask.
+        num_reports: Number of reports which are taken into account.
+
+    Returns:
+    -------
+        str: Answer to the question.
+
+    """
+    return run_sync(aask(question, num_reports=num_reports))
@@ -1,10 +1,8 @@
 """Contains the chains used for the different tasks.
 """
-from langchain.chat_models import ChatOpenAI
-from langchain.output_parsers import OutputFixingParser
-from langchain.output_parsers.json import SimpleJsonOutputParser
-from langchain.output_parsers.list import CommaSeparatedListOutputParser
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_openai import ChatOpenAI
 
 from .prompts import (
     prompt_check_for_scope,
@@ -12,8 +10,6 @@ from .prompts import (
     prompt_get_reports_from_scope,
     prompt_qa,
     prompt_retrieve_keywords,
-    prompt_retrieve_keywords_fix,
-    prompt_retrieve_reports_list_fix,
     prompt_summarize,
 )
 from .utils.logger import Logger
@@ -21,17 +17,30 @@ from .utils.logger import Logger
 # Define a logger
 log = Logger(__name__)
 
+
+# -----
+# Output schemas (structured output guarantees the schema, so no output fixing is needed)
+# -----
+class Keywords(BaseModel):
+
+    """Keywords and publication year of a report."""
+
+    keywords: list[str] = Field(description='Keywords which summarize the report')
+    year: int | None = Field(description='Year the report was published')
+
+
+class ReportList(BaseModel):
+
+    """Selection of reports."""
+
+    keys: list[int] = Field(description='Keys of the selected reports')
+
+
 # -----
 # Index preprocessing
 # -----
 chain_retrieve_keywords = (
-    prompt_retrieve_keywords
-    | ChatOpenAI(model='gpt-3.5-turbo', temperature=0)
-    | OutputFixingParser(
-        parser=SimpleJsonOutputParser(),
-        prompt=prompt_retrieve_keywords_fix,
-        max_retries=3,
-    )
+    prompt_retrieve_keywords | ChatOpenAI(model='gpt-3.5-turbo', temperature=0).with_structured_output(Keywords)
 )
 
 # -----
@@ -44,27 +53,25 @@ chain_check_for_scope = prompt_check_for_scope | ChatOpenAI(model='gpt-4', tempe
 # If scope is given in question, get the corresponding reports
 chain_get_reports_from_scope = (
     prompt_get_reports_from_scope
-    | ChatOpenAI(model='gpt-3.5-turbo', temperature=0)
-    | OutputFixingParser(
-        parser=CommaSeparatedListOutputParser(),
-        prompt=prompt_retrieve_reports_list_fix,
-        max_retries=3,
-    )
+    | ChatOpenAI(model='gpt-3.5-turbo', temperature=0).with_structured_output(ReportList)
 )
 
 # If no scope is given in question, get the 10 most relevant reports for the question
 chain_get_reports_from_question = (
     prompt_get_reports_from_question
-    | ChatOpenAI(model='gpt-3.5-turbo', temperature=0)
-    | OutputFixingParser(
-        parser=CommaSeparatedListOutputParser(),
-        prompt=prompt_retrieve_reports_list_fix,
-        max_retries=7,
-    )
+    | ChatOpenAI(model='gpt-3.5-turbo', temperature=0).with_structured_output(ReportList)
 )
 
 # -----
 # Question answering
 # -----
-chain_summarize = prompt_summarize | ChatOpenAI(model='gpt-4', temperature=0) | StrOutputParser()
-chain_qa = prompt_qa | ChatOpenAI(model='gpt-4', temperature=0) | StrOutputParser()
+chain_summarize = (
+    prompt_summarize
+    | ChatOpenAI(model='gpt-4o-mini', temperature=0, max_tokens=150, request_timeout=30, max_retries=2)
+    | StrOutputParser()
+)
+chain_qa = (
+    prompt_qa
+    | ChatOpenAI(model='gpt-4o-mini', temperature=0, max_tokens=250, request_timeout=30, max_retries=2)
+    | StrOutputParser()
+)
@@ -5,5 +5,7 @@ from pathlib import Path
 
 ASK_IEA_DIR = Path.home() / '.ask-iea'
 
-PATH_REPORTS_INDEX = Path(ASK_IEA_DIR) / 'reports_index.csv'
+PATH_REPORTS_INDEX = Path(ASK_IEA_DIR) / 'reports_index.parquet'
 PATH_FAISS_STORE = Path(ASK_IEA_DIR) / 'faiss_store'
+PATH_LLM_CACHE = Path(ASK_IEA_DIR) / 'llm_cache.db'
+PATH_EMBEDDINGS_CACHE = Path(ASK_IEA_DIR) / 'embeddings_cache'
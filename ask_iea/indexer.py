@@ -1,18 +1,38 @@
 """Module to index reports from the IEA page.
 """
 
-import itertools
+import asyncio
+from collections.abc import Iterable
+from pathlib import Path
 
+import httpx
 import numpy as np
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
 from .utils.logger import Logger
+from .utils.utils import HTTP_TIMEOUT, get_http_session, run_sync
 
 # Define a logger
 log = Logger(__name__)
 
+# Maximum number of report pages which are scraped concurrently
+MAX_CONCURRENT_REQUESTS = 16
+
+# Only parse the parts of the pages which are needed
+STRAINER_REPORT_PAGE = SoupStrainer(['h1', 'div', 'article', 'a'])
+STRAINER_LISTING_PAGE = SoupStrainer('div', class_='o-layout__main')
+
+# Column dtypes of the index (besides 'date_published', which is stored as datetime)
+INDEX_DTYPES = {
+    'url_report': 'string',
+    'title': 'string',
+    'abstract': 'string',
+    'url_pdf': 'string',
+    '_year': 'Int16',
+    '_keywords': 'string',
+}
+
 
 class ReportIndexer:
 
@@ -24,8 +44,37 @@ class ReportIndexer:
                 columns=['url_report', 'title', 'abstract', 'date_published', 'url_pdf', '_year', '_keywords']
             )
             self.df.index.name = 'report_id'
-        else:
+        elif Path(path_df).suffix == '.csv':
+            # Index files of older versions are stored as CSV
             self.df = pd.read_csv(path_df, index_col='report_id')
+        else:
+            self.df = pd.read_parquet(path_df)
+
+        if path_df is not None:
+            self._replay_log(path_df)
+        self._set_dtypes()
+
+    @staticmethod
+    def _get_log_path(path_df: str) -> Path:
+        return Path(path_df).with_suffix('.log.jsonl')
+
+    def _replay_log(self, path_df: str) -> None:
+        path_log = self._get_log_path(path_df)
+        if not path_log.exists() or path_log.stat().st_size == 0:
+            return
+
+        # Later entries overwrite earlier ones, column by column
+        df_log = pd.read_json(path_log, lines=True, dtype=False, convert_dates=False)
+        df_log = df_log.groupby('report_id', sort=False).last()
+        is_new = ~df_log.index.isin(self.df.index)
+        self.df.update(df_log[~is_new])
+        # Reports which are not in the index file yet are appended
+        self.df = pd.concat([self.df, df_log[is_new].reindex(columns=self.df.columns)])
+        log.info('Replayed %d rows from "%s".', len(df_log), path_log)
+
+    def _set_dtypes(self) -> None:
+        self.df = self.df.astype({col: dtype for col, dtype in INDEX_DTYPES.items() if col in self.df.columns})
+        self.df['date_published'] = pd.to_datetime(self.df['date_published'])
 
     @staticmethod
     def scrape_report_information(url_report: str) -> dict:
@@ -40,11 +89,86 @@ class ReportIndexer:
             dict: Dictionary with the report data.
 
         """
-        response = requests.get(url_report)
+        response = get_http_session().get(url_report, timeout=HTTP_TIMEOUT)
         if response.status_code != 200:
             msg = f'Failed to load page. Status code: {response.status_code}. URL: {url_report}.'
             raise Exception(msg)
-        soup = BeautifulSoup(response.text, 'html.parser')
+
+        return ReportIndexer._parse_report_information(url_report, response.content)
+
+    @staticmethod
+    async def _ascrape_page(page: int, already_scraped_urls: set, max_reports: int = None) -> list | None:
+        """Scrape a page of the IEA Analysis page and the information of all new reports listed on it.
+
+        The page and its reports are fetched with the same client, the reports concurrently.
+
+        Args:
+        ----
+            page: Page number to scrape.
+            already_scraped_urls: Set of URLs which have already been scraped.
+            max_reports: Maximum number of new reports to scrape. If None, all new reports are scraped.
+
+        Returns:
+        -------
+            list: List of dictionaries with the data of the new reports. None, if the page does not exist.
+
+        """
+        limits = httpx.Limits(max_connections=2 * MAX_CONCURRENT_REQUESTS)
+        async with httpx.AsyncClient(http2=True, limits=limits, timeout=HTTP_TIMEOUT, follow_redirects=True) as client:
+            # Send an HTTP GET request to the URL of the IEA Analysis page
+            response = await client.get(f'https://www.iea.org/analysis?page={page}')
+
+            # Check if the request was successful
+            if response.status_code != 200:
+                if response.status_code == 500:
+                    return None
+                msg = f'Failed to retrieve the page. Status code: {response.status_code}.'
+                raise Exception(msg)
+
+            # Parse the raw bytes of the page, so that lxml detects the encoding itself, instead of decoding them first
+            soup = BeautifulSoup(response.content, 'lxml', parse_only=STRAINER_LISTING_PAGE)
+
+            # Find the container that holds the report links
+            report_container = soup.find('div', class_='o-layout__main').find('ul', class_='m-card-listing')
+            # Find all report links within the container
+            report_links = report_container.find_all('a')
+            # Keep the order of the links, but drop links which are listed multiple times
+            report_links = list(dict.fromkeys('https://www.iea.org' + link['href'] for link in report_links))
+            new_reports = [url_path for url_path in report_links if url_path not in already_scraped_urls]
+            new_reports = new_reports[:max_reports]
+
+            # Scrape all new reports of the page concurrently
+            return await ReportIndexer._ascrape_reports_information(client, new_reports)
+
+    @staticmethod
+    async def _ascrape_reports_information(client: httpx.AsyncClient, urls_report: list) -> list:
+        """Scrape the information of multiple reports concurrently. See `scrape_report_information`.
+
+        Args:
+        ----
+            client: HTTP client to use.
+            urls_report: List of URLs to the report pages.
+
+        Returns:
+        -------
+            list: List of dictionaries with the report data, in the same order as the URLs.
+
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+        async def _ascrape(url_report: str) -> dict:
+            async with semaphore:
+                response = await client.get(url_report)
+            if response.status_code != 200:
+                msg = f'Failed to load page. Status code: {response.status_code}. URL: {url_report}.'
+                raise Exception(msg)
+            return ReportIndexer._parse_report_information(url_report, response.content)
+
+        return await asyncio.gather(*[_ascrape(url_report) for url_report in urls_report])
+
+    @staticmethod
+    def _parse_report_information(url_report: str, html: bytes) -> dict:
+        soup = BeautifulSoup(html, 'lxml', parse_only=STRAINER_REPORT_PAGE)
 
         # Title
         title = soup.find('h1').text
@@ -86,23 +210,29 @@ class ReportIndexer:
         }
 
     def index_generator(
-        self, already_scraped_urls: list = None, pages: [int] = None, break_after_n_pages: int = 1
+        self,
+        already_scraped_urls: Iterable = None,
+        pages: [int] = None,
+        break_after_n_pages: int = 1,
+        max_reports: int = None,
     ) -> dict:
         """Generator which yields the report metadata of all reports on the IEA Analysis page.
 
         Args:
         ----
-            already_scraped_urls: List of URLs which have already been scraped.
+            already_scraped_urls: URLs which have already been scraped.
             pages: List of page numbers to scrape. If None, all pages are scraped.
             break_after_n_pages: Stop scraping after n pages, if no new reports have been found.
+            max_reports: Stop scraping after n new reports. If None, all new reports are scraped.
 
         Returns:
         -------
             dict: Dictionary with the reports' metadata.
 
         """
-        if already_scraped_urls is None:
-            already_scraped_urls = []
+        # Use a set for constant time lookups. It is also updated with each scraped report, so that reports which
+        # are listed on multiple pages are only scraped once
+        already_scraped_urls = set(already_scraped_urls) if already_scraped_urls is not None else set()
 
         if not pages:
             pages = np.arange(1, 1000)
@@ -110,53 +240,37 @@ class ReportIndexer:
         num_known_pages = 0
 
         for page in pages:
-            log.info(f'Indexing page {page}...')
-            # Define the URL of the IEA Analysis page
-            url = f'https://www.iea.org/analysis?page={page}'
-
-            # Send an HTTP GET request to the URL
-            response = requests.get(url)
-
-            # Check if the request was successful
-            if response.status_code != 200:
-                if response.status_code == 500:
-                    log.info(f'Page {page} not found. Stop scraping process.')
-                    break
-                msg = f'Failed to retrieve the page. Status code: {response.status_code}.'
-                raise Exception(msg)
-
-            # Parse the HTML content of the page
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # Find the container that holds the report links
-            report_container = soup.find('div', class_='o-layout__main').find('ul', class_='m-card-listing')
-            # Find all report links within the container
-            report_links = report_container.find_all('a')
-            report_links = ['https://www.iea.org' + link['href'] for link in report_links]
-            # Extract and print the report titles and URLs
-            new_reports = [url_path for url_path in report_links if url_path not in already_scraped_urls]
+            log.info('Indexing page %d...', page)
+            new_reports = run_sync(self._ascrape_page(page, already_scraped_urls, max_reports))
+            if new_reports is None:
+                log.info('Page %d not found. Stop scraping process.', page)
+                break
 
             if len(new_reports) == 0:
                 num_known_pages += 1
-                log.info(f'\tNo new reports found on page {page}.')
+                log.info('\tNo new reports found on page %d.', page)
 
             # Break if no new reports have been found on the page
             if num_known_pages == break_after_n_pages:
                 break
 
-            for url in new_reports:
-                try:
-                    report_data = self.scrape_report_information(url)
-                except Exception as e:
-                    raise e
-                msg = f'\tIndexed new report: {url}.'
-                if not report_data['url_pdf']:
-                    msg += ' (No PDF found)'
-                log.info(msg)
+            for report_data in new_reports:
+                log.info(
+                    '\tIndexed new report: %s.%s',
+                    report_data['url_report'],
+                    '' if report_data['url_pdf'] else ' (No PDF found)',
+                )
 
+                already_scraped_urls.add(report_data['url_report'])
                 yield report_data
 
-    def add_new_reports(self, n_newest: int = 10, pages: [int] = None, break_after_n_pages: int = 1) -> None:
+            # Only scrape as many reports as requested, instead of all reports of the remaining pages
+            if max_reports is not None:
+                max_reports -= len(new_reports)
+                if max_reports <= 0:
+                    break
+
+    def add_new_reports(self, n_newest: int = 10, pages: [int] = None, break_after_n_pages: int = 1) -> list:
         """Add new reports to the index.
 
         Args:
@@ -165,17 +279,51 @@ class ReportIndexer:
             pages: List of page numbers to scrape. If None, all pages are scraped.
             break_after_n_pages: Stop scraping after n pages, if no new reports have been found.
 
+        Returns:
+        -------
+            list: IDs of the added reports.
+
         """
         index_generator = self.index_generator(
-            already_scraped_urls=self.df['url_report'].tolist(), pages=pages, break_after_n_pages=break_after_n_pages
+            already_scraped_urls=self.df['url_report'],
+            pages=pages,
+            break_after_n_pages=break_after_n_pages,
+            max_reports=n_newest or None,
         )
-        if n_newest:
-            index_generator = itertools.islice(index_generator, n_newest)
 
-        for report in index_generator:
-            report_id = report['url_report'].split('/')[-1]
-            self.df.loc[report_id] = report
+        # Collect the new reports and add them at once, since adding single rows copies the whole DataFrame
+        new_reports = pd.DataFrame(
+            list(index_generator), columns=['url_report', 'title', 'abstract', 'date_published', 'url_pdf']
+        )
+        new_reports.index = new_reports['url_report'].str.split('/').str[-1].rename('report_id')
+        # Drop reports which are already in the index or were scraped multiple times, since the index must be unique
+        new_reports = new_reports[~new_reports.index.duplicated(keep='last') & ~new_reports.index.isin(self.df.index)]
+        self.df = pd.concat([self.df, new_reports])
+
+        # Adding rows can upcast the columns to object
+        self._set_dtypes()
+
+        return new_reports.index.tolist()
 
     def save_to_file(self, filename: str) -> None:
-        """Save the index to a CSV file."""
-        self.df.to_csv(filename, index_label='report_id')
+        """Save the index to a Parquet file. This also clears the log of the file (see `save_to_log`)."""
+        self.df.to_parquet(filename, engine='pyarrow', compression='zstd')
+        self._get_log_path(filename).unlink(missing_ok=True)
+
+    def save_to_log(self, filename: str, report_ids: list, columns: list) -> None:
+        """Append the given rows to the log of an index file, instead of rewriting the whole file.
+
+        The log is replayed when the index is loaded and cleared when the index is saved with `save_to_file`.
+
+        Args:
+        ----
+            filename: Path to the index file.
+            report_ids: IDs of the reports to save.
+            columns: Columns to save.
+
+        """
+        if not report_ids:
+            return
+        lines = self.df.loc[report_ids, columns].reset_index().to_json(orient='records', lines=True, date_format='iso')
+        with open(self._get_log_path(filename), 'a') as f:
+            f.write(lines if lines.endswith('\n') else lines + '\n')
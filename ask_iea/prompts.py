@@ -18,18 +18,11 @@ prompt_retrieve_keywords = PromptTemplate(
     'Provide me a list of keywords, which summarizes the report in a precise way. '
     'It is known that the article is published by the IEA, so ignore all keywords which are unnecessary in this '
     'regard. Provide around 10 keywords. Also provide me the year the article was published.\n'
-    'Return the information as a dict with the keys: kewords, year\n. Only return the dict. Nothing else. \n\n'
     '\n'
     'Title: {title}\n'
     'Date Published: {date_published}\n'
     'Abstract: {abstract}',
 )
-# Fix output
-prompt_retrieve_keywords_fix = PromptTemplate(
-    input_variables=[],
-    template='Please provide a dict as output, with the keys: keywords, year. Only return the dict. Nothing else. '
-    'If no keywords are found, return an empty list. If no year is found, return None.',
-)
 
 # -----
 # Question answering retrieval: Preselect reports (scope, before using FAISS)
@@ -52,8 +45,8 @@ prompt_get_reports_from_scope = PromptTemplate(
     template='Check which report or group of reports is mentioned in the description below. The reports are from the '
     'International Energy Agency (IEA). Go through each report and see if it matches the description. '
     'If the report could be slightly relevant, list it. \n\n'
-    'Only provide me a list of keys, separated by commas. '
-    'Do not provide any other information. Do not give'
+    'Only provide me a list of keys. '
+    'Do not provide any other information. Do not give '
     'any additional information. Do not make up any information. \n\n'
     'Scope: {scope}\n\n'
     'Reports: \n - {reports}\n\n',
@@ -66,19 +59,13 @@ prompt_get_reports_from_question = PromptTemplate(
     'add the World Energy Outlook (WEO). '
     'All reports are from the IEA (International Energy Agency). '
     'Papers are listed as $KEY,$REPORT_PUBLICATION_YEAR,$REPORT_TITLE. '
-    'Return a list of keys, separated by commas. Only return the keys. Do not return any other information. '
-    'Return "None", if no papers are applicable. '
+    'Return a list of keys. Only return the keys. Do not return any other information. '
+    'Return an empty list, if no papers are applicable. '
     'Choose reports timely if the question requires timely information. \n\n'
     'Question: {question}\n\n'
     'Reports: \n - {reports}\n\n',
 )
 
-# Fix output
-prompt_retrieve_reports_list_fix = PromptTemplate(
-    input_variables=[],
-    template='Please only return a list of keys, separated by commas. Do not return any other information. ',
-)
-
 # -----
 # Question answering
 # -----
@@ -3,16 +3,93 @@
 To initialize a logger, use the following code:
 .utils.logger import Logger
 log = Logger('<package_name>')
+
+Log calls use lazy %-style arguments (e.g. `log.info('Added %d reports.', n)`), so messages are only formatted if the
+record is emitted. Guard expensive arguments with `log.isEnabledFor(...)`.
 """
-import datetime as dt
+import atexit
 import logging
 import os
-from logging.handlers import SMTPHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, SMTPHandler
 
 logging.addLevelName(logging.DEBUG, 'D')
 logging.addLevelName(logging.INFO, 'I')
 logging.captureWarnings(True)
 
+# Formatters are shared by all loggers
+_FMT_STREAM = logging.Formatter(
+    fmt='[%(asctime)s %(time_relative)5s] %(levelname)s:%(lineno)d:%(funcName)s - %(message)s',
+    datefmt='%H:%M:%S',
+)
+_FMT_FILE = logging.Formatter(
+    fmt='[%(asctime)s %(time_relative)5s] %(levelname)s:%(lineno)d:%(funcName)s - %(message)s',
+    datefmt='%y%m%d %H:%M:%S',
+)
+
+# Records for the file handlers of all loggers are passed through one queue and written by one listener in a
+# background thread, so that logging does not block on disk I/O
+_FILE_LOG_QUEUE = queue.Queue(-1)
+_file_log_listener = None
+
+_LEVEL_NAME_TO_LEVEL = {
+    'CRITICAL': logging.CRITICAL,
+    'ERROR': logging.ERROR,
+    'WARNING': logging.WARNING,
+    'INFO': logging.INFO,
+    'DEBUG': logging.DEBUG,
+    'NOTSET': logging.NOTSET,
+}
+
+
+class _FileQueueHandler(QueueHandler):
+
+    """Queue handler which attaches the file handlers of its logger to each record, see `_FileHandlerDispatcher`."""
+
+    def __init__(self, file_handlers: list):
+        super().__init__(_FILE_LOG_QUEUE)
+        self.set_file_handlers(file_handlers)
+
+    def set_file_handlers(self, file_handlers: list) -> None:
+        # Only queue records which at least one file handler emits, since queued records are prepared (and their
+        # message formatted) on the calling thread
+        self.file_handlers = tuple(file_handlers)
+        self.setLevel(min((handler.level for handler in self.file_handlers), default=logging.CRITICAL + 1))
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.file_handlers = self.file_handlers
+        return record
+
+
+class _FileHandlerDispatcher(logging.Handler):
+
+    """Handler of the shared listener, which passes each record to the file handlers of the logger that created it."""
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        for handler in record.file_handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+
+def _start_file_log_listener() -> None:
+    global _file_log_listener
+    if _file_log_listener is None:
+        _file_log_listener = QueueListener(_FILE_LOG_QUEUE, _FileHandlerDispatcher())
+        _file_log_listener.start()
+
+
+def _stop_file_log_listener() -> None:
+    global _file_log_listener
+    # Stopping processes all records which are still in the queue
+    if _file_log_listener is not None:
+        _file_log_listener.stop()
+        _file_log_listener = None
+
+
+atexit.register(_stop_file_log_listener)
+
 
 # noinspection PyUnresolvedReferences,PyAttributeOutsideInit
 class FilterTimeTaker(logging.Filter):
@@ -37,15 +114,11 @@ class FilterTimeTaker(logging.Filter):
             bool: Always returns True so that the log record is not filtered out.
 
         """
-        try:
-            last = self.last
-        except AttributeError:
-            last = record.relativeCreated
-
-        delta = dt.datetime.fromtimestamp(record.relativeCreated / 1000.0) - dt.datetime.fromtimestamp(last / 1000.0)
+        last = getattr(self, 'last', record.relativeCreated)
 
-        duration_minutes = delta.seconds // 60  # Get the whole minutes
-        duration_seconds = delta.seconds % 60  # Get the remaining seconds
+        delta_seconds = int((record.relativeCreated - last) // 1000)
+        duration_minutes = delta_seconds // 60  # Get the whole minutes
+        duration_seconds = delta_seconds % 60  # Get the remaining seconds
 
         record.time_relative = f'{duration_minutes:02d}:{duration_seconds:02d}'
         self.last = record.relativeCreated
@@ -136,15 +209,8 @@ class Logger(logging.Logger):
         super().__init__(self.name)
         self.setLevel(logging.DEBUG)
 
-        # Create formatters
-        self._fmt_stream = logging.Formatter(
-            fmt='[%(asctime)s %(time_relative)5s] %(levelname)s:%(lineno)d:%(funcName)s - %(message)s',
-            datefmt='%H:%M:%S',
-        )
-        self._fmt_file = logging.Formatter(
-            fmt='[%(asctime)s %(time_relative)5s] %(levelname)s:%(lineno)d:%(funcName)s - %(message)s',
-            datefmt='%y%m%d %H:%M:%S',
-        )
+        self._fmt_stream = _FMT_STREAM
+        self._fmt_file = _FMT_FILE
 
         # Create stream handler
         h_stream = logging.StreamHandler()
@@ -158,7 +224,7 @@ class Logger(logging.Logger):
         h_file.setLevel(file_level)
         h_file.setFormatter(self._fmt_file)
         h_file.addFilter(FilterTimeTaker())
-        self.addHandler(h_file)
+        file_handlers = [h_file]
 
         # Create file handler for all logs
         if path_all_logs:
@@ -166,10 +232,13 @@ class Logger(logging.Logger):
             h_all_logs.setLevel(logging.NOTSET)
             h_all_logs.setFormatter(self._fmt_file)
             h_all_logs.addFilter(FilterTimeTaker())
-            self.addHandler(h_all_logs)
+            file_handlers.append(h_all_logs)
 
-        # Create pre_disabled_methods to allow disabling and enabling logging (see disable_logging and enable_logging)
-        self._pre_disabled_methods = {}
+        # File handlers are run by the shared listener in a background thread (see `_FILE_LOG_QUEUE`)
+        self._file_handlers = file_handlers
+        self._queue_handler = _FileQueueHandler(self._file_handlers)
+        self.addHandler(self._queue_handler)
+        _start_file_log_listener()
 
     def change_log_file_path(self, new_log_file: str) -> None:
         """Change the path of the log file to the given path.
@@ -179,10 +248,11 @@ class Logger(logging.Logger):
             new_log_file (str): The new path for the log file.
 
         """
-        # Remove old file handler
-        for handler in self.handlers:
+        # Remove old file handler. The old handler is not closed, since queued records may still be written with it
+        handlers = self._file_handlers
+        for handler in handlers:
             if isinstance(handler, logging.FileHandler):
-                self.removeHandler(handler)
+                handlers.remove(handler)
                 break
         # If new_log_file is given, create a new file handler with it
         if new_log_file:
@@ -192,7 +262,10 @@ class Logger(logging.Logger):
             new_file_handler = logging.FileHandler(new_log_file)
             new_file_handler.setLevel(logging.DEBUG)
             new_file_handler.setFormatter(self._fmt_file)
-            self.addHandler(new_file_handler)
+            handlers.append(new_file_handler)
+
+        # Queued records keep the file handlers they were created with
+        self._queue_handler.set_file_handlers(handlers)
 
     def change_log_level(self, new_log_level: str or int) -> None:
         """Change the log level to the given level.
@@ -202,21 +275,12 @@ class Logger(logging.Logger):
             new_log_level (str or int): The new log level. Can be a string (e.g., 'DEBUG', 'INFO') or an integer (0-50).
 
         """
-        level_name_to_level = {
-            'CRITICAL': logging.CRITICAL,
-            'ERROR': logging.ERROR,
-            'WARNING': logging.WARNING,
-            'INFO': logging.INFO,
-            'DEBUG': logging.DEBUG,
-            'NOTSET': logging.NOTSET,
-        }
-
         if isinstance(new_log_level, str):
             new_log_level = new_log_level.upper()
-            if new_log_level not in level_name_to_level:
+            if new_log_level not in _LEVEL_NAME_TO_LEVEL:
                 msg = f"Invalid log level name '{new_log_level}'."
                 raise ValueError(msg)
-            new_log_level = level_name_to_level[new_log_level]
+            new_log_level = _LEVEL_NAME_TO_LEVEL[new_log_level]
 
         if isinstance(new_log_level, int) and (0 <= new_log_level <= 50):
             self.setLevel(new_log_level)
@@ -228,32 +292,14 @@ class Logger(logging.Logger):
             raise ValueError(msg)
 
     def disable_logging(self) -> None:
-        """Disables logging by replacing the logging methods with the standard python print function."""
-        self._pre_disabled_methods = {
-            'debug': self.debug,
-            'info': self.info,
-            'warning': self.warning,
-            'error': self.error,
-            'critical': self.critical,
-        }
-
-        self.debug = print
-        self.info = print
-        self.warning = print
-        self.error = print
-        self.critical = print
+        """Disable logging. Calls are then dropped by `isEnabledFor`, before any message is formatted."""
+        # The level is not raised instead, since the cache of `isEnabledFor` is only cleared for loggers which are
+        # registered in the logging manager
+        self.disabled = True
 
     def enable_logging(self) -> None:
-        """Restore the original logging methods to enable logging."""
-        try:
-            self.debug = self._pre_disabled_methods['debug']
-            self.info = self._pre_disabled_methods['info']
-            self.warning = self._pre_disabled_methods['warning']
-            self.error = self._pre_disabled_methods['error']
-            self.critical = self._pre_disabled_methods['critical']
-        except KeyError:
-            # Ignore since it was not disabled before
-            pass
+        """Enable logging again after it was disabled."""
+        self.disabled = False
 
     def add_smtp_handler(
         self,
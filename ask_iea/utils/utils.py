@@ -1,4 +1,19 @@
 """Some utility functions."""
+import asyncio
+import hashlib
+import uuid
+from collections.abc import Coroutine
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_NAMESPACE_DNS_BYTES = uuid.NAMESPACE_DNS.bytes
+
+# Timeout in seconds for synchronous HTTP requests
+HTTP_TIMEOUT = 30
 
 
 def batch(iterable: list, n: int) -> list:
@@ -14,6 +29,59 @@ def batch(iterable: list, n: int) -> list:
         list: List of batches.
 
     """
-    length = len(iterable)
-    for ndx in range(0, length, n):
-        yield iterable[ndx : min(ndx + n, length)]
+    # Slicing already clamps to the length of the iterable
+    for ndx in range(0, len(iterable), n):
+        yield iterable[ndx : ndx + n]
+
+
+def content_uuid(text: str) -> str:
+    """Create a UUID string for a text. Same as `str(uuid.uuid5(uuid.NAMESPACE_DNS, text))`, but faster.
+
+    Args:
+    ----
+        text (str): Text to create the UUID for.
+
+    Returns:
+    -------
+        str: UUID string.
+
+    """
+    digest = bytearray(hashlib.sha1(_NAMESPACE_DNS_BYTES + text.encode('utf-8')).digest()[:16])
+    digest[6] = (digest[6] & 0x0F) | 0x50  # Version 5
+    digest[8] = (digest[8] & 0x3F) | 0x80  # RFC 4122 variant
+    x = digest.hex()
+    return f'{x[:8]}-{x[8:12]}-{x[12:16]}-{x[16:20]}-{x[20:]}'
+
+
+@lru_cache(maxsize=1)
+def get_http_session() -> requests.Session:
+    """Get a shared HTTP session, so that connections are pooled and kept alive between requests.
+
+    Failed requests due to server errors are retried with a backoff.
+    """
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry))
+    return session
+
+
+def run_sync(coroutine: Coroutine) -> object:
+    """Run a coroutine to completion, also if an event loop is already running in this thread (e.g. in Jupyter).
+
+    Args:
+    ----
+        coroutine (Coroutine): Coroutine to run.
+
+    Returns:
+    -------
+        object: Result of the coroutine.
+
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # `asyncio.run` cannot be called from a running event loop, so the coroutine is run in a worker thread instead
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -1,23 +1,147 @@
 """Module which contains the vectorstore class, which is used as the underlying database.
 """
 
+import random
 import time
-import uuid
+from bisect import bisect_right
+from collections import deque
+from collections.abc import Collection, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
+import faiss
 import langchain.vectorstores
 import openai
 import pandas as pd
-from langchain.document_loaders import PyPDFLoader
+from langchain.docstore import InMemoryDocstore
+from langchain.document_loaders.blob_loaders import Blob
+from langchain.document_loaders.parsers import PyPDFParser
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 from .utils.logger import Logger
-from .utils.utils import batch
+from .utils.utils import HTTP_TIMEOUT, content_uuid, get_http_session
 
 # Define a logger
 log = Logger(__name__)
 
+# Maximum number of PDF files which are downloaded concurrently
+MAX_PDF_DOWNLOADS = 16
+
+# Separator which is used to join the pages of a report before splitting it
+PAGE_SEPARATOR = '\n\n'
+
+# Text splitter which is used to chunk the reports. It is stateless, so it can be shared. The start index of each
+# chunk is needed to map it back to its page
+_TEXT_SPLITTER = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=150, add_start_index=True)
+
+# Retry settings for rate limited embedding requests. Delays are given in seconds
+RATE_LIMIT_MAX_ATTEMPTS = 8
+RATE_LIMIT_INITIAL_DELAY = 1.0
+RATE_LIMIT_MAX_DELAY = 60.0
+
+
+@lru_cache(maxsize=1)
+def _get_embeddings() -> OpenAIEmbeddings:
+    # Share one client between all vectorstores, instead of setting it up again for each of them
+    return OpenAIEmbeddings()
+
+
+def _load_pdf(url_pdf: str) -> list:
+    # Download the PDF file with the shared session, so that connections to the server are reused
+    response = get_http_session().get(url_pdf, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    return list(PyPDFParser().lazy_parse(Blob.from_data(response.content, path=url_pdf)))
+
+
+def _iter_pdfs(urls_pdf: Iterable) -> Iterator[list]:
+    """Download and parse PDF files concurrently and yield their pages in the given order.
+
+    At most `MAX_PDF_DOWNLOADS` files are loaded ahead, so that not all of them are kept in memory at once.
+
+    Args:
+    ----
+        urls_pdf: URLs to the PDF files.
+
+    Yields:
+    ------
+        list: Pages of a PDF file.
+
+    """
+    executor = ThreadPoolExecutor(max_workers=MAX_PDF_DOWNLOADS)
+    futures = deque()
+    try:
+        for url_pdf in urls_pdf:
+            futures.append(executor.submit(_load_pdf, url_pdf))
+            if len(futures) == MAX_PDF_DOWNLOADS:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        # Do not wait for pending downloads, if the generator is closed early (e.g. due to an error of the consumer)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _split_report(doc_pages: list, report_metadata: dict) -> list:
+    """Split the pages of a report into documents.
+
+    The joined text of all pages is split at once, so that documents can overlap across pages. Afterwards, each
+    document is mapped back to the page it starts on.
+
+    Args:
+    ----
+        doc_pages: Pages of the report.
+        report_metadata: Metadata which is added to each document.
+
+    Returns:
+    -------
+        list: Documents of the report.
+
+    """
+    metadata = {**doc_pages[0].metadata, **report_metadata}
+    page_starts, offset = [], 0
+    for page in doc_pages:
+        page_starts.append(offset)
+        offset += len(page.page_content) + len(PAGE_SEPARATOR)
+    full_text = PAGE_SEPARATOR.join(page.page_content for page in doc_pages)
+
+    docs = _TEXT_SPLITTER.create_documents([full_text], metadatas=[metadata])
+    for doc in docs:
+        page_idx = max(bisect_right(page_starts, doc.metadata.pop('start_index')) - 1, 0)
+        doc.metadata['page'] = doc_pages[page_idx].metadata['page']
+    return docs
+
+
+def _drop_known_docs(docs: list, seen_ids: set, existing_ids: Collection) -> (list, list):
+    """Create a unique id for each document based on its content and drop all documents which are already known.
+
+    Args:
+    ----
+        docs: Documents to check.
+        seen_ids: Ids of all documents which were seen before. New ids are added to it.
+        existing_ids: Ids of all documents which are already in the vectorstore.
+
+    Returns:
+    -------
+        (list, list): New documents and their ids.
+
+    """
+    # Keep only the first document per content, so that duplicate contents (e.g. repeated headers) are hashed only once
+    docs_by_content = {}
+    for doc in docs:
+        docs_by_content.setdefault(doc.page_content, doc)
+
+    new_docs, new_ids = [], []
+    for content, doc in docs_by_content.items():
+        doc_id = content_uuid(content)
+        if doc_id in seen_ids or doc_id in existing_ids:
+            continue
+        seen_ids.add(doc_id)
+        new_docs.append(doc)
+        new_ids.append(doc_id)
+    return new_docs, new_ids
+
 
 class VectorStore(langchain.vectorstores.FAISS):
 
@@ -29,16 +153,65 @@ class VectorStore(langchain.vectorstores.FAISS):
             raise ValueError(msg)
 
         if db_path is not None:
-            new_instance = langchain.vectorstores.FAISS.load_local(db_path, OpenAIEmbeddings())
-            log.info(f'Loaded {len(new_instance.docstore._dict)} docs from "{db_path}".')
+            new_instance = langchain.vectorstores.FAISS.load_local(db_path, _get_embeddings())
+            log.info('Loaded %d docs from "%s".', len(new_instance.docstore._dict), db_path)
             self.__dict__.update(new_instance.__dict__)
         elif index_df is not None:
             log.info('Creating new vectorstore.')
-            docs, ids = self._load_index(index_df)
-            new_instance = langchain.vectorstores.FAISS.from_documents(docs, OpenAIEmbeddings(), ids=ids)
+            batches = self._iter_batches(index_df)
+            first_batch = next(batches, None)
+            if first_batch is None:
+                msg = 'No documents found to create the vectorstore from.'
+                raise ValueError(msg)
+            batch_docs, batch_ids = first_batch
+            embeddings = _get_embeddings()
+            texts = [doc.page_content for doc in batch_docs]
+            vectors = embeddings.embed_documents(texts)
+
+            # Store the vectors as FP16 instead of FP32, which halves the memory footprint of the index
+            index = faiss.IndexScalarQuantizer(len(vectors[0]), faiss.ScalarQuantizer.QT_fp16)
+            new_instance = langchain.vectorstores.FAISS(embeddings, index, InMemoryDocstore(), {})
+            new_instance.add_embeddings(
+                zip(texts, vectors), metadatas=[doc.metadata for doc in batch_docs], ids=batch_ids
+            )
             self.__dict__.update(new_instance.__dict__)
+            self._add_batches(batches)
+
+        self._cached_embed_query = lru_cache(maxsize=2048)(super()._embed_query)
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed a query. Embeddings are cached, since the same questions are often asked repeatedly.
+
+        Args:
+        ----
+            text: Query to embed.
+
+        Returns:
+        -------
+            list: Embedding of the query.
+
+        """
+        return self._cached_embed_query(text)
+
+    def _embed_query(self, text: str) -> list[float]:
+        return self.embed_query(text)
+
+    def _iter_batches(self, index_df: pd.DataFrame, batch_size: int = 100) -> Iterator[tuple[list, list]]:
+        """Load the reports and yield their new documents in batches.
+
+        Only the reports which are currently downloaded (see `_iter_pdfs`) and one batch of documents are kept in
+        memory, instead of all documents of all reports.
 
-    def _load_index(self, index_df: pd.DataFrame) -> (list, list):
+        Args:
+        ----
+            index_df: DataFrame with the reports to be loaded.
+            batch_size: Number of documents per batch.
+
+        Yields:
+        ------
+            (list, list): Batch of documents and their ids.
+
+        """
         # Only load reports that have a PDF file
         needs_load = index_df[index_df['url_pdf'].notna() & index_df['_keywords'].notna()]
         if needs_load.empty:
@@ -49,52 +222,70 @@ class VectorStore(langchain.vectorstores.FAISS):
         except AttributeError:
             pass
 
-        log.info(f'Start adding {len(needs_load)} new reports from {len(index_df)} passed reports.')
-
-        documents = []
-        for report_id, row in needs_load.iterrows():
-            loader = PyPDFLoader(row.url_pdf)
-            doc_pages = loader.load()
-            for page in doc_pages:
-                page.metadata['url_report'] = row.url_report
-                page.metadata['report_id'] = report_id
-                page.metadata['title'] = row.title
-                page.metadata['abstract'] = row.abstract
-                page.metadata['date_published'] = row.date_published
-                page.metadata['_year'] = row._year
-                page.metadata['_keywords'] = row._keywords
-            documents.extend(doc_pages)
+        log.info('Start adding %d new reports from %d passed reports.', len(needs_load), len(index_df))
 
-        log.debug(f'\tLoaded {len(documents)} pages from {len(needs_load)} reports.')
+        # The docstore does not exist yet for new vectorstores
+        existing_ids = getattr(getattr(self, 'docstore', None), '_dict', {}).keys()
+        seen_ids = set()
+        pending_docs, pending_ids = [], []
+        num_pages = num_docs = 0
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=150)
-        docs = text_splitter.split_documents(documents)
+        # Iterate over plain tuples, since namedtuples do not support the column names with leading underscores
+        columns = ['url_report', 'title', 'abstract', 'date_published', '_year', '_keywords']
+        rows = needs_load[columns].itertuples(name=None)
 
-        log.debug(f'\tCreated {len(docs)} docs from {len(documents)} pages.')
+        for row, doc_pages in zip(rows, _iter_pdfs(needs_load['url_pdf'])):
+            if not doc_pages:
+                continue
+            report_id, url_report, title, abstract, date_published, year, keywords = row
+            report_metadata = {
+                'url_report': url_report,
+                'report_id': report_id,
+                'title': title,
+                'abstract': abstract,
+                'date_published': date_published,
+                '_year': year,
+                '_keywords': keywords,
+            }
+            docs = _split_report(doc_pages, report_metadata)
+            num_pages += len(doc_pages)
+            num_docs += len(docs)
 
-        # Create a list of unique ids for each document based on the content
-        ids = [str(uuid.uuid5(uuid.NAMESPACE_DNS, doc.page_content)) for doc in docs]
-        unique_ids = list(set(ids))
+            new_docs, new_ids = _drop_known_docs(docs, seen_ids, existing_ids)
+            pending_docs.extend(new_docs)
+            pending_ids.extend(new_ids)
 
-        # Ensure that only docs that correspond to unique ids are kept and that only one of the duplicate ids is kept
-        seen_ids = set()
-        unique_docs = [
-            doc for doc, doc_id in zip(docs, ids) if doc_id not in seen_ids and (seen_ids.add(doc_id) or True)
-        ]
+            while len(pending_docs) >= batch_size:
+                yield pending_docs[:batch_size], pending_ids[:batch_size]
+                del pending_docs[:batch_size], pending_ids[:batch_size]
 
-        # Drop all documents that are already in the vectorstore (from unique_docs and unique_ids)
-        try:
-            unique_docs = [doc for idx, doc in enumerate(unique_docs) if unique_ids[idx] not in self.docstore._dict]
-            unique_ids = [doc_id for doc_id in unique_ids if doc_id not in self.docstore._dict]
-        except AttributeError:
-            pass
+        if pending_docs:
+            yield pending_docs, pending_ids
 
-        if len(unique_docs) == 0:
+        log.debug('\tLoaded %d pages and created %d docs from %d reports.', num_pages, num_docs, len(needs_load))
+        if len(seen_ids) == 0:
             log.debug('No new documents to add to the database.')
+        log.info('Added %d new unique docs from %d reports.', len(seen_ids), len(needs_load))
 
-        log.info(f'Added {len(unique_docs)} new unique docs from {len(needs_load)} reports.')
-
-        return unique_docs, unique_ids
+    def _add_batches(self, batches: Iterable) -> None:
+        for batch_docs, batch_ids in batches:
+            # Add the documents per batch to handle potential rate limit errors. Back off exponentially with jitter,
+            # but prefer the waiting time suggested by the server
+            delay = RATE_LIMIT_INITIAL_DELAY
+            for attempt in range(1, RATE_LIMIT_MAX_ATTEMPTS + 1):
+                try:
+                    self.add_documents(batch_docs, ids=batch_ids)
+                    break
+                except openai.RateLimitError as e:
+                    if attempt == RATE_LIMIT_MAX_ATTEMPTS:
+                        raise
+                    retry_after = e.response.headers.get('retry-after')
+                    wait = float(retry_after) if retry_after else delay
+                    log.warning(
+                        'Rate limit reached. Waiting %.1f seconds before trying again (attempt %d).', wait, attempt
+                    )
+                    time.sleep(wait + random.random() * 0.25)
+                    delay = min(delay * 2, RATE_LIMIT_MAX_DELAY)
 
     def add_new_reports(self, index_df: pd.DataFrame) -> None:
         """Add new reports to the vectorstore.
@@ -104,14 +295,4 @@ class VectorStore(langchain.vectorstores.FAISS):
             index_df: DataFrame with the reports to be added.
 
         """
-        docs, ids = self._load_index(index_df)
-        if len(docs) > 0:
-            # Loop over documents in batches to handle potential rate limit errors
-            for batch_docs, batch_ids in zip(batch(docs, 100), batch(ids, 100)):
-                while True:
-                    try:
-                        self.add_documents(batch_docs, ids=batch_ids)
-                        break
-                    except openai.RateLimitError:
-                        log.warning('Rate limit reached. Waiting 5 seconds before trying again.')
-                        time.sleep(5)
+        self._add_batches(self._iter_batches(index_df))